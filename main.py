@@ -1,11 +1,15 @@
-import json
+import asyncio
+import importlib.util
 import logging
-from collections import Counter
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
-from pymongo import MongoClient
+from itertools import chain
+import httpx
+from lxml import etree
+import orjson
+from pymongo import ASCENDING, MongoClient, WriteConcern
+from pymongo.errors import BulkWriteError
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import time
 
@@ -13,39 +17,124 @@ import time
 MONGO_URI = 'mongodb://localhost:27017'
 DB_NAME = 'onurcan_pekgoz'
 
+# Word frequency configurations
+# Count words in Python instead of MongoDB, e.g. for tokenization the aggregation pipeline cannot do
+LOCAL_WORD_COUNT = False
+# Characters str.split() treats as whitespace, so server-side words match the Python-side split
+WORD_REGEX = r'[^\s\x{1c}-\x{1f}\x{85}\x{a0}\x{1680}\x{2000}-\x{200a}\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}]+'
+
+# HTTP configurations
+REQUEST_TIMEOUT = httpx.Timeout(15, connect=5)
+# HTTP/2 needs the optional h2 package (httpx[http2]); without it requests fall back to HTTP/1.1
+HTTP2_ENABLED = importlib.util.find_spec('h2') is not None
+
 # Logging configuration
 logging.basicConfig(filename='logs/logs.log', level=logging.INFO)
 
 
+# Listing page XPath compiled once; it selects only the 11th-20th post links
+POST_LINK_XPATH = etree.XPath('(//a[contains(concat(" ", normalize-space(@class), " "), " post-link ")])'
+                              '[position() > 10 and position() <= 20]/@href')
+
+# Tags of the article elements fetch_news reads; everything else is skipped while parsing
+NEWS_TAGS = ('h1', 'h2', 'div', 'img', 'script')
+
+
+# Function that checks whether an element carries the given CSS class
+def has_class(element, class_name):
+    return class_name in (element.get('class') or '').split()
+
+
+# Function that fills article fields from parser events
+def collect_news_fields(events, fields):
+    for _, element in events:
+        if element.tag == 'h1' and fields['header'] is None and has_class(element, 'single_title'):
+            fields['header'] = ''.join(element.itertext()).strip()
+        elif element.tag == 'h2' and fields['summary'] is None and has_class(element, 'single_excerpt'):
+            fields['summary'] = ''.join(element.itertext()).strip()
+        elif element.tag == 'div' and fields['text'] is None and has_class(element, 'yazi_icerik'):
+            fields['text'] = ' '.join([''.join(p.itertext()).strip() for p in element.iter('p')])
+        elif element.tag == 'img' and element.get('data-src') and has_class(element, 'rhd-article-news-img'):
+            fields['img_url_list'].append(element.get('data-src'))
+        elif element.tag == 'script' and fields['json_data'] is None and has_class(element, 'rank-math-schema'):
+            fields['json_data'] = element.text or ''
+        else:
+            continue
+
+        # Children have all been handled by their own end events, so the subtree can be freed
+        element.clear(keep_tail=True)
+
+
 class NewsScraper:
-    def __init__(self, main_page_url, mongo_uri, db_name):
+    def __init__(self, main_page_url, mongo_uri, db_name, concurrency=50):
         self.main_page_url = main_page_url
         self.mongo_uri = mongo_uri
         self.db_name = db_name
+        self.concurrency = concurrency
 
-    # Function that fetches news details
-    def fetch_news(self, url):
+        # Caps simultaneous requests to the news site
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        # Single thread-safe client whose connection pool backs every database call
+        self.client = MongoClient(mongo_uri, maxPoolSize=concurrency)
+        self.db = self.client[db_name]
+        self.create_indexes()
+
+        # Per-page stats collected by store_stats and written by flush_stats
+        self._stats_buffer = []
+
+    # Function that creates news indexes for grouping by update_date and skipping duplicate articles
+    def create_indexes(self):
         try:
-            response = requests.get(url)
+            news_collection = self.db['news']
+            news_collection.create_index([('update_date', ASCENDING)])
+            news_collection.create_index([('url', ASCENDING)], unique=True)
+
+        except Exception as e:
+            logging.error(f"Error creating indexes in MongoDB: {str(e)}")
+
+    # Function that downloads a page body while holding a request slot
+    async def fetch_html(self, session, url):
+        async with self.semaphore:
+            response = await session.get(url)
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+            return response.content
 
-            header = soup.find('h1', {'class': 'single_title'}).text.strip()
-            summary = soup.find('h2', {'class': 'single_excerpt'}).text.strip()
+    # Function that streams an article into the parser as it downloads
+    async def fetch_news_fields(self, session, url):
+        fields = {'header': None, 'summary': None, 'text': None, 'img_url_list': [], 'json_data': None}
+        parser = etree.HTMLPullParser(events=('end',), tag=NEWS_TAGS)
 
-            text_div = soup.find('div', {'class': 'yazi_icerik'})
-            paragraphs = text_div.find_all('p')
-            text = ' '.join([p.text.strip() for p in paragraphs])
+        async with self.semaphore:
+            async with session.stream('GET', url) as response:
+                response.raise_for_status()
+                # Article images can appear anywhere on the page, so the whole body is parsed
+                async for chunk in response.aiter_bytes(8192):
+                    parser.feed(chunk)
+                    collect_news_fields(parser.read_events(), fields)
 
-            img_tags = soup.find_all('img', {'class': 'rhd-article-news-img'})
-            img_url_list = [img['data-src'] for img in img_tags]
+        parser.close()
+        collect_news_fields(parser.read_events(), fields)
+        return fields
 
-            json_data = soup.find('script', {'class': 'rank-math-schema'}).text
-            json_data = json.loads(json_data)
-            publish_date = datetime.strptime(json_data['@graph'][5]['datePublished'], '%Y-%m-%dT%H:%M:%S%z').strftime(
-                '%Y-%m-%d')
-            update_date = datetime.strptime(json_data['@graph'][5]['dateModified'], '%Y-%m-%dT%H:%M:%S%z').strftime(
-                '%Y-%m-%d')
+    # Function that fetches news details
+    async def fetch_news(self, session, url):
+        try:
+            news_fields = await self.fetch_news_fields(session, url)
+
+            header = news_fields['header']
+            summary = news_fields['summary']
+            text = news_fields['text']
+            img_url_list = news_fields['img_url_list']
+
+            if header is None or summary is None or text is None:
+                logging.error(f"Missing header, summary or text in {url}")
+                return None
+
+            json_data = orjson.loads(news_fields['json_data'] or '')
+            # Dates are ISO-8601, so the leading 'YYYY-MM-DD' is the date part
+            publish_date = json_data['@graph'][5]['datePublished'][:10]
+            update_date = json_data['@graph'][5]['dateModified'][:10]
 
             return {
                 'url': url,
@@ -57,10 +146,10 @@ class NewsScraper:
                 'update_date': update_date
             }
 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logging.error(f"Error making a request to {url}: {str(e)}")
             return None
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logging.error(f"Error decoding JSON data from {url}: {str(e)}")
             return None
         except Exception as e:
@@ -68,47 +157,68 @@ class NewsScraper:
             return None
 
     # Function that fetches pages and call fetch_news for all news
-    def fetch_page(self, current_page_url):
+    async def fetch_page(self, session, current_page_url):
         try:
-            response = requests.get(current_page_url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+            content = await self.fetch_html(session, current_page_url)
+            tree = etree.HTML(content)
 
-            news_links = [a['href'] for a in soup.find_all('a', {'class': 'post-link'})[10:20]]
+            news_links = [str(href) for href in POST_LINK_XPATH(tree)]
 
-            news = []
-            for link in news_links:
-                news_url = link
-                news_data = self.fetch_news(news_url)
-                if news_data:
-                    news.append(news_data)
+            # Articles are fetched concurrently; the shared semaphore still bounds total requests
+            news_results = await asyncio.gather(*[self.fetch_news(session, news_url) for news_url in news_links])
+            news = [news_data for news_data in news_results if news_data]
 
             return news
 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logging.error(f"Error making a request to {current_page_url}: {str(e)}")
             return []
         except Exception as e:
             logging.error(f"Unexpected error: {str(e)}", exc_info=True)
             return []
 
-    # Function that finds most common 10 words across all news texts and store to database
-    def find_most_common_words(self, news_texts):
-        combined_text = ' '.join(news_texts)
-        words = combined_text.split()
-        word_counter = Counter(words)
+    # Function that counts most common 10 words server-side so only they come back from MongoDB
+    def count_words_in_database(self):
+        news_collection = self.db['news']
+        pipeline = [
+            {"$project": {"word": {"$regexFindAll": {"input": "$text", "regex": WORD_REGEX}}}},
+            {"$unwind": "$word"},
+            {"$group": {"_id": "$word.match", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 10}
+        ]
+
+        return [(item['_id'], item['count']) for item in news_collection.aggregate(pipeline, allowDiskUse=True)]
+
+    # Function that counts most common 10 words in Python, streaming only the text field of each news
+    def count_words_locally(self):
+        # Imported here so runs that count words in MongoDB do not pay pandas' import cost
+        import pandas as pd
+
+        news_collection = self.db['news']
+        cursor = news_collection.find({}, {'text': 1, '_id': 0}).batch_size(500)
+
+        # value_counts needs every word in one array; chain builds it without a per-word Python loop
+        words = list(chain.from_iterable(item['text'].split() for item in cursor))
+        word_counts = pd.Series(words, dtype=object).value_counts().head(10)
+
+        # Counts are numpy integers, which MongoDB cannot encode
+        return [(word, int(count)) for word, count in word_counts.items()]
 
+    # Function that finds most common 10 words across all news texts and store to database
+    def find_most_common_words(self, local_count=False):
         try:
-            client = MongoClient(self.mongo_uri)
-            db = client[self.db_name]
-            word_frequency_collection = db['word_frequency']
+            word_frequency_collection = self.db['word_frequency']
 
-            word_frequency_collection.delete_many({})
+            if local_count:
+                most_common_words = self.count_words_locally()
+            else:
+                most_common_words = self.count_words_in_database()
 
-            most_common_words = word_counter.most_common(10)
+            word_frequency_collection.delete_many({})
 
-            for word, count in most_common_words:
-                word_frequency_collection.insert_one({'word': word, 'count': count})
+            word_frequency_data = [{'word': word, 'count': count} for word, count in most_common_words]
+            word_frequency_collection.insert_many(word_frequency_data)
             logging.info("Successfully inserted word frequency data into the MongoDB 'word_frequency' collection.")
 
             self.plot_most_common_words(most_common_words)
@@ -125,49 +235,62 @@ class NewsScraper:
         plt.ylabel('Frequency')
         plt.title('Most Common Words')
         plt.savefig('graph.png')
-        plt.show()
+        plt.close()
 
     # Function that stores news data to database
     def store_news_data(self, news):
         try:
-            client = MongoClient(self.mongo_uri)
-            db = client[self.db_name]
-            news_collection = db['news']
-            news_collection.insert_many(news)
+            news_collection = self.db['news']
+            # Unordered so one duplicate url does not abort the rest of the batch
+            news_collection.insert_many(news, ordered=False, bypass_document_validation=True)
             logging.info("Successfully inserted news data into the MongoDB 'news' collection.")
 
+        except BulkWriteError as e:
+            write_errors = e.details['writeErrors']
+            duplicate_count = len([error for error in write_errors if error['code'] == 11000])
+            logging.info(f"Inserted {e.details['nInserted']} news into the MongoDB 'news' collection, "
+                         f"skipped {duplicate_count} duplicates.")
+            if duplicate_count < len(write_errors):
+                logging.error(f"Error storing news data in MongoDB: {str(e)}")
         except Exception as e:
             logging.error(f"Error storing news data in MongoDB: {str(e)}")
 
-    # Function that stores stats data to database
+    # Function that buffers stats data until flush_stats writes it to database
     def store_stats(self, elapsed_time, count, success_count, fail_count):
-        try:
-            client = MongoClient(self.mongo_uri)
-            db = client[self.db_name]
-            stats_collection = db['stats']
-            current_date = datetime.now().strftime('%Y-%m-%d %H:%M')
-
-            stats_data = {
-                'elapsed_time': elapsed_time,
-                'count': count,
-                'date': current_date,
-                'success_count': success_count,
-                'fail_count': fail_count
-            }
+        current_date = datetime.now().strftime('%Y-%m-%d %H:%M')
 
-            stats_collection.insert_one(stats_data)
-            logging.info("Successfully inserted stats data into the MongoDB 'stats' collection.")
+        stats_data = {
+            'elapsed_time': elapsed_time,
+            'count': count,
+            'date': current_date,
+            'success_count': success_count,
+            'fail_count': fail_count
+        }
+
+        self._stats_buffer.append(stats_data)
+
+    # Function that stores all buffered stats data to database in one round-trip
+    def flush_stats(self):
+        if not self._stats_buffer:
+            return
+
+        try:
+            # Stats are telemetry, so they are written unacknowledged to stay off the critical path
+            stats_collection = self.db.get_collection('stats', write_concern=WriteConcern(w=0))
+            stats_collection.insert_many(self._stats_buffer)
+            logging.info("Sent stats data to the MongoDB 'stats' collection.")
+            self._stats_buffer = []
 
         except Exception as e:
             logging.error(f"Error storing stats data in MongoDB: {str(e)}")
 
-    # Function that analyzes stats and calls stor_stats
-    def analyze_and_store_data(self, page_number):
+    # Function that analyzes stats, calls store_stats and returns the page's news
+    async def analyze_and_store_data(self, session, page_number):
         start_time = time.time()
 
         current_page_url = f"{self.main_page_url}/page/{page_number}/"
 
-        news = self.fetch_page(current_page_url)
+        news = await self.fetch_page(session, current_page_url)
 
         end_time = time.time()
         elapsed_time = end_time - start_time
@@ -178,17 +301,28 @@ class NewsScraper:
         self.store_stats(elapsed_time, count, success_count, fail_count)
 
         if not news:
-            logging.warning(f"No news results to insert into MongoDB for page {page_number}.")
-            return
+            logging.warning(f"No news results found for page {page_number}.")
 
-        self.store_news_data(news)
+        return news
+
+    # Function that scrapes all pages concurrently over a shared HTTP session and returns all their news
+    async def scrape_pages(self, page_numbers):
+        # HTTP/2 multiplexes concurrent article fetches over few connections; httpx decodes gzip/brotli bodies
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=20)
+        async with httpx.AsyncClient(http2=HTTP2_ENABLED, follow_redirects=True, limits=limits,
+                                     timeout=REQUEST_TIMEOUT) as session:
+            pages = [self.analyze_and_store_data(session, page_number) for page_number in page_numbers]
+
+            all_news = []
+            for page in asyncio.as_completed(pages):
+                all_news.extend(await page)
+
+            return all_news
 
     # Function that prints grouped news data
     def print_data_grouped_by_update_date(self):
         try:
-            client = MongoClient(self.mongo_uri)
-            db = client[self.db_name]
-            news_collection = db['news']
+            news_collection = self.db['news']
 
             pipeline = [
                 {"$group": {"_id": "$update_date", "count": {"$sum": 1},
@@ -208,22 +342,21 @@ class NewsScraper:
 
 
 def main():
+    concurrency = 50
     scraper = NewsScraper(main_page_url='https://turkishnetworktimes.com/kategori/gundem/', mongo_uri=MONGO_URI,
-                          db_name=DB_NAME)
-    threads = 10
+                          db_name=DB_NAME, concurrency=concurrency)
     max_page_numbers = 50
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        page_numbers = range(1, max_page_numbers + 1)
-        executor.map(scraper.analyze_and_store_data, page_numbers)
-
-    all_news_texts = []
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    news_collection = db['news']
-    for item in news_collection.find():
-        all_news_texts.append(item['text'])
-
-    scraper.find_most_common_words(all_news_texts)
+    page_numbers = range(1, max_page_numbers + 1)
+    all_news = asyncio.run(scraper.scrape_pages(page_numbers))
+    scraper.flush_stats()
+
+    # All pages are stored with a single insert_many instead of one per page
+    if all_news:
+        scraper.store_news_data(all_news)
+    else:
+        logging.warning("No news results to insert into MongoDB.")
+
+    scraper.find_most_common_words(local_count=LOCAL_WORD_COUNT)
     scraper.print_data_grouped_by_update_date()
 
 